@@ -0,0 +1,168 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+# Methods that deliver something to a user and may fail with 429/403
+SEND_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendAudio",
+    "sendVoice", "sendSticker", "sendMediaGroup", "forwardMessage", "copyMessage"
+}
+
+BOT_USER = {
+    "id": 1000000,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": True
+}
+
+
+class FakeBotAPI:
+    """Local HTTP server answering Bot API calls with canned responses"""
+
+    def __init__(self, latency=0.0, jitter=0.0, retry_after_rate=0.0, forbidden_rate=0.0,
+                 member_status="member", seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.forbidden_rate = forbidden_rate
+        self.member_status = member_status
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.send_times = []
+        self.server = None
+        self.port = None
+        self._message_id = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self._dispatch(path.rsplit("/", 1)[-1], headers, body)
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    "Connection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _parse_params(self, headers, body):
+        content_type = headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            params = {}
+            for key, values in parse_qs(body.decode()).items():
+                try:
+                    params[key] = json.loads(values[0])
+                except ValueError:
+                    params[key] = values[0]
+            return params
+        # Multipart uploads: the parameters are not needed for canned replies
+        return {}
+
+    async def _dispatch(self, method, headers, body):
+        self.calls[method] += 1
+        params = self._parse_params(headers, body)
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method in SEND_METHODS:
+            self.send_times.append(time.perf_counter())
+            roll = self.random.random()
+            if roll < self.retry_after_rate:
+                self.errors["retry_after"] += 1
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1}
+                }
+            if roll < self.retry_after_rate + self.forbidden_rate:
+                self.errors["forbidden"] += 1
+                return 403, {
+                    "ok": False,
+                    "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user"
+                }
+
+        return 200, {"ok": True, "result": self._result(method, params)}
+
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = params.get("chat_id", 1)
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id if isinstance(chat_id, int) else -1, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", "")
+        }
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getChat":
+            return {"id": -1001234567890, "type": "supergroup", "title": "Bench Chat"}
+        if method == "getChatMember":
+            user_id = params.get("user_id", 1)
+            return {
+                "status": self.member_status,
+                "user": {"id": user_id, "is_bot": False, "first_name": "User"}
+            }
+        if method == "createChatInviteLink":
+            return {
+                "invite_link": "https://t.me/+bench",
+                "creator": BOT_USER,
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": False
+            }
+        if method == "copyMessage":
+            self._message_id += 1
+            return {"message_id": self._message_id}
+        if method == "sendMediaGroup":
+            return [self._message(params) for _ in params.get("media", [None])]
+        if method.startswith(("send", "forward", "edit")):
+            return self._message(params)
+        return True
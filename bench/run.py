@@ -0,0 +1,319 @@
+"""Offline load tests against a fake Bot API and a local MongoDB stand-in.
+
+Usage: python -m bench.run [scenario ...] [--users N] [--latency S] ...
+Run from the repository root. Scenarios default to all of them.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+from bench.fake_bot_api import FakeBotAPI
+
+ADMIN_ID = 1
+# Scenarios wipe and reseed collections, so they get a database of their own
+BENCH_DB = os.getenv("BENCH_MONGODB_DB", "telegram_bot_bench")
+
+
+def load_bot(fake):
+    """Import main configured for the fake API and a local MongoDB stand-in"""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "1000000:BENCH",
+        "TELEGRAM_BASE_URL": fake.base_url,
+        "TELEGRAM_CHANNEL_ID": "@bench_channel",
+        "MONGODB_URI": os.getenv("BENCH_MONGODB_URI", "mongodb://localhost:27017"),
+        "MONGODB_DB": BENCH_DB,
+        "ADMIN_USER_ID": str(ADMIN_ID),
+        "BROADCAST_DELAY": "0",
+    })
+    uri = os.getenv("BENCH_MONGODB_URI")
+    if uri and not any(host in uri for host in ("localhost", "127.0.0.1")):
+        # Scenarios wipe and reseed collections, never point them at a shared server
+        raise SystemExit("BENCH_MONGODB_URI must point to a local MongoDB")
+    if BENCH_DB == "telegram_bot_db":
+        raise SystemExit("BENCH_MONGODB_DB must not be the bot's own database")
+    if not uri:
+        # Without a local mongod, fall back to an in-memory MongoDB implementation
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+
+    import main
+    return main
+
+
+class Updates:
+    """Factory for synthetic Telegram update payloads"""
+
+    def __init__(self):
+        self.update_id = 0
+
+    def _next_id(self):
+        self.update_id += 1
+        return self.update_id
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id, text, **extra):
+        message = {
+            "message_id": self._next_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+            **extra
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return message
+
+    def command(self, user_id, text, **extra):
+        return {"update_id": self._next_id(), "message": self._message(user_id, text, **extra)}
+
+    def callback(self, user_id, data="check_membership"):
+        return {
+            "update_id": self._next_id(),
+            "callback_query": {
+                "id": str(self._next_id()),
+                "from": self._user(user_id),
+                "chat_instance": "bench",
+                "data": data,
+                "message": self._message(user_id, "verification")
+            }
+        }
+
+
+class Result:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.wall_time = 0.0
+        self.api_calls = {}
+        self.api_errors = {}
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            "scenario": self.name,
+            "count": len(latencies),
+            "throughput": len(latencies) / self.wall_time if self.wall_time else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+            "api_calls": self.api_calls,
+            "api_errors": self.api_errors,
+        }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+async def drive(application, payloads, concurrency):
+    """Feed updates through the handlers. Returns per-update latencies and wall time"""
+    from telegram import Update
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(payload):
+        async with semaphore:
+            update = Update.de_json(payload, application.bot)
+            start = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(process(payload) for payload in payloads))
+    return latencies, time.perf_counter() - start
+
+
+def seed_users(main, count):
+    main.users_collection.delete_many({})
+    batch = []
+    for user_id in range(10_000, 10_000 + count):
+        batch.append({"user_id": user_id, "username": f"user{user_id}", "first_name": "User", "date_added": time.time()})
+        if len(batch) == 10_000:
+            main.users_collection.insert_many(batch)
+            batch = []
+    if batch:
+        main.users_collection.insert_many(batch)
+
+
+def seed_lectures(main, count):
+    main.custom_commands_collection.delete_many({})
+    names = ["maths", "physics", "chemistry", "biology", "history", "geography", "english", "economics"]
+    for i in range(count):
+        name = names[i % len(names)] + "".join(chr(ord("a") + int(d)) for d in str(i // len(names)))
+        main.custom_commands_collection.insert_one({
+            "command": name,
+            "link": f"https://t.me/{name}group",
+            "description": f"{name.capitalize()} study group"
+        })
+
+
+async def scenario_start_storm(main, application, updates, args, fake):
+    payloads = [updates.command(20_000_000 + i, "/start") for i in range(args.users)]
+    return await drive(application, payloads, args.concurrency)
+
+
+async def scenario_callback_storm(main, application, updates, args, fake):
+    # Every user mashes "I've Joined" several times in a row
+    payloads = [
+        updates.callback(30_000_000 + i)
+        for i in range(max(1, args.users // args.taps))
+        for _ in range(args.taps)
+    ]
+    return await drive(application, payloads, args.concurrency)
+
+
+async def scenario_lecture_reads(main, application, updates, args, fake):
+    commands = list(main.lecture_registry) or ["lecture"]
+    payloads = []
+    for i in range(args.users):
+        text = "/lecture" if i % 2 == 0 else f"/{commands[i % len(commands)]}"
+        payloads.append(updates.command(40_000_000 + i, text))
+    return await drive(application, payloads, args.concurrency)
+
+
+async def run_broadcast_scenario(main, application, updates, args, text, reply=None, fake=None):
+    seed_users(main, args.broadcast_users)
+    payload = updates.command(ADMIN_ID, text, reply_to_message=reply) if reply else updates.command(ADMIN_ID, text)
+    fake.send_times.clear()
+    await drive(application, [payload], 1)
+
+    # The command only schedules the job; wait for it to reach every recipient
+    if main.broadcast_task:
+        await main.broadcast_task
+
+    # Per-recipient latency is the gap between consecutive deliveries at the fake API
+    times = fake.send_times
+    return [later - earlier for earlier, later in zip(times, times[1:])], times[-1] - times[0]
+
+
+async def scenario_broadcast(main, application, updates, args, fake):
+    return await run_broadcast_scenario(main, application, updates, args, "/broadcast Benchmark announcement", fake=fake)
+
+
+async def scenario_fcast(main, application, updates, args, fake):
+    reply = updates._message(ADMIN_ID, "Forward me")
+    return await run_broadcast_scenario(main, application, updates, args, "/fcast", reply=reply, fake=fake)
+
+
+SCENARIOS = {
+    "start_storm": scenario_start_storm,
+    "callback_storm": scenario_callback_storm,
+    "lecture_reads": scenario_lecture_reads,
+    "broadcast": scenario_broadcast,
+    "fcast": scenario_fcast,
+}
+
+
+async def run(args):
+    fake = FakeBotAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        retry_after_rate=args.retry_after_rate,
+        forbidden_rate=args.forbidden_rate,
+        seed=args.seed
+    )
+    await fake.start()
+    main = load_bot(fake)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("main").setLevel(logging.ERROR)
+    seed_lectures(main, args.lectures)
+
+    application = main.build_application()
+    await application.initialize()
+    await main.warm_up(application)
+    updates = Updates()
+
+    results = []
+    for name in args.scenarios:
+        fake.calls.clear()
+        fake.errors.clear()
+        main.flood_buckets.clear()
+
+        result = Result(name)
+        result.latencies, result.wall_time = await SCENARIOS[name](main, application, updates, args, fake)
+        result.api_calls = dict(fake.calls)
+        result.api_errors = dict(fake.errors)
+        results.append(result.as_dict())
+
+    await application.shutdown()
+    await fake.stop()
+    return results
+
+
+def print_report(results):
+    print(f"{'scenario':<16}{'count':>8}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}  api calls")
+    for r in results:
+        calls = ", ".join(f"{k}={v}" for k, v in sorted(r["api_calls"].items()))
+        print(f"{r['scenario']:<16}{r['count']:>8}{r['throughput']:>12.1f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}  {calls}")
+        if r["api_errors"]:
+            print(f"{'':<16}injected errors: {r['api_errors']}")
+
+
+def check_regressions(results, baseline_path, tolerance):
+    """Return scenarios whose p99 grew more than `tolerance` over the baseline"""
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)}
+    regressions = []
+    for r in results:
+        base = baseline.get(r["scenario"])
+        if base and base["p99_ms"] and r["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: p99 {base['p99_ms']:.2f} -> {r['p99_ms']:.2f} ms")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline bot benchmarks")
+    parser.add_argument("scenarios", nargs="*", help=f"any of: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--users", type=int, default=2000, help="synthetic users per storm scenario")
+    parser.add_argument("--broadcast-users", type=int, default=100_000, help="recipients for broadcast/fcast")
+    parser.add_argument("--taps", type=int, default=5, help="callback taps per user in callback_storm")
+    parser.add_argument("--lectures", type=int, default=50, help="lecture commands to seed")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Bot API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency in seconds")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="share of sends answered with 429")
+    parser.add_argument("--forbidden-rate", type=float, default=0.0, help="share of sends answered with 403")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="fail if p99 regressed against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p99 regression ratio")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, args.tolerance)
+        if regressions:
+            print("Performance regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
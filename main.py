@@ -1,18 +1,50 @@
 import os
+import re
+import io
+import csv
+import copy
+import gzip
+import json
+import itertools
+import tempfile
 import logging
 import threading
 import time
 import sys
+import socket
 import asyncio
+from collections import OrderedDict
 from flask import Flask, Response
-from pymongo import MongoClient
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from pymongo import MongoClient, ReturnDocument, UpdateOne, ReplaceOne, DeleteOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from telegram import (
+    Update,
+    Message,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+    InputFile,
+    InputMediaPhoto,
+    InputMediaVideo,
+    InputMediaDocument,
+    InputMediaAudio,
+    MessageEntity
+)
+from telegram.error import Forbidden
+from telegram.helpers import create_deep_linked_url
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
+    BasePersistence,
+    PersistenceInput,
     filters
 )
 
@@ -25,7 +57,8 @@ def home():
 
 @app.route('/health')
 def health_check():
-    return Response(status=200)
+    # Only report healthy once the startup warm-up has finished
+    return Response(status=200 if bot_ready.is_set() else 503)
 
 # Enhanced logging setup
 logging.basicConfig(
@@ -37,9 +70,13 @@ logger = logging.getLogger(__name__)
 # Bot start time for uptime calculation
 bot_start_time = time.time()
 
+# Set once startup warm-up has finished and the bot accepts traffic
+bot_ready = threading.Event()
+
 # Global variables for broadcast control
 broadcast_active = False
 broadcast_cancelled = False
+broadcast_paused = False
 broadcast_task = None
 
 # Helper function to format uptime
@@ -54,8 +91,73 @@ TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHANNEL_ID = os.getenv("TELEGRAM_CHANNEL_ID", "").strip()
 GROUP_ID = os.getenv("TELEGRAM_GROUP_ID", "").strip()
 MONGODB_URI = os.getenv("MONGODB_URI")
+MONGODB_DB = os.getenv("MONGODB_DB", "telegram_bot_db")
 ADMIN_USER_ID = os.getenv("ADMIN_USER_ID")
 TUTORIAL_VIDEO_LINK = os.getenv("TUTORIAL_VIDEO_LINK", "https://youtube.com/shorts/UhccqnGY3PY?si=1aswpXBhcFP8L8tM")
+# Optional self-hosted Bot API server, e.g. http://localhost:8081/bot
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "").strip()
+
+# Delay between broadcast sends to stay below Telegram's rate limits
+BROADCAST_DELAY = float(os.getenv("BROADCAST_DELAY", "0.1"))
+
+# Flood control: (refill rate in tokens/second, bucket size) per update class
+FLOOD_LIMITS = {
+    "callback": (float(os.getenv("FLOOD_CALLBACK_RATE", "0.2")), int(os.getenv("FLOOD_CALLBACK_BURST", "3"))),
+    "command": (float(os.getenv("FLOOD_COMMAND_RATE", "0.5")), int(os.getenv("FLOOD_COMMAND_BURST", "5"))),
+    "message": (float(os.getenv("FLOOD_MESSAGE_RATE", "1")), int(os.getenv("FLOOD_MESSAGE_BURST", "10"))),
+}
+FLOOD_CALLBACK_CACHE_TIME = int(os.getenv("FLOOD_CALLBACK_CACHE_TIME", "10"))
+FLOOD_CALLBACK_RESPONSE = "⏳ Too many requests. Please wait a few seconds and try again."
+FLOOD_MESSAGE_RESPONSE = "⏳ You're sending commands too fast. Please slow down."
+
+# Multi-instance coordination
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+BROADCAST_LEASE = "broadcast"
+BROADCAST_LEASE_TTL = int(os.getenv("BROADCAST_LEASE_TTL", "60"))
+LEADER_LEASE = "leader"
+LEADER_LEASE_TTL = int(os.getenv("LEADER_LEASE_TTL", "30"))
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "5"))
+BROADCAST_RESUME_INTERVAL = float(os.getenv("BROADCAST_RESUME_INTERVAL", "15"))
+
+# How long a successful membership check is trusted, and how often
+# user/chat/bot data is written back to MongoDB
+VERIFICATION_TTL = int(os.getenv("VERIFICATION_TTL", "3600"))
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "30"))
+# Minimum seconds between reloads of one user's data written by other replicas
+PERSISTENCE_REFRESH_INTERVAL = float(os.getenv("PERSISTENCE_REFRESH_INTERVAL", "5"))
+
+# Background re-verification of recently active users
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL", "60"))
+SWEEP_ACTIVE_WINDOW = int(os.getenv("SWEEP_ACTIVE_WINDOW", "86400"))
+SWEEP_REVERIFY_AFTER = int(os.getenv("SWEEP_REVERIFY_AFTER", str(VERIFICATION_TTL // 2)))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "100"))
+SWEEP_RATE = float(os.getenv("SWEEP_RATE", "2"))  # membership lookups per second
+SWEEP_IDLE_SECONDS = float(os.getenv("SWEEP_IDLE_SECONDS", "1"))
+
+# Inline lecture search
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+INLINE_RESULTS_LIMIT = 50  # Telegram's maximum per answer
+LECTURE_INDEX_MAX_PREFIX = 20
+
+# Lecture import limits
+LECTURE_IMPORT_MAX_BYTES = 5 * 1024 * 1024
+LECTURE_IMPORT_MAX_ERRORS_SHOWN = 20
+
+# User export snapshots, also used as frozen broadcast audiences
+USER_EXPORT_BATCH_SIZE = int(os.getenv("USER_EXPORT_BATCH_SIZE", "1000"))
+PINNED_AUDIENCE = "pinned"
+
+# Interval for writing buffered statistics counters to MongoDB
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "10"))
+STATS_TREND_DAYS = 7
+
+# Graceful shutdown deadline for paused broadcasts and buffer flushes
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
+# Webhook mode (required when running several replicas)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip('/')
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
 
 # Verify required environment variables
 if not all([TOKEN, MONGODB_URI, ADMIN_USER_ID]):
@@ -71,20 +173,557 @@ REQUIRES_VERIFICATION = bool(CHANNEL_ID or GROUP_ID)
 # MongoDB setup
 try:
     client = MongoClient(MONGODB_URI)
-    db = client.telegram_bot_db
+    db = client[MONGODB_DB]
     users_collection = db.users
     custom_commands_collection = db.custom_commands
-    logger.info("Connected to MongoDB successfully")
-    
-    # Create index for command names
-    custom_commands_collection.create_index("command", unique=True)
+    locks_collection = db.locks
+    cache_versions_collection = db.cache_versions
+    broadcast_jobs_collection = db.broadcast_jobs
+    stats_collection = db.stats
+    persistence_collection = db.persistence
+    audiences_collection = db.audiences
+    logger.info("MongoDB client created")
 except Exception as e:
     logger.error(f"MongoDB connection failed: {e}")
     exit(1)
 
+def acquire_lease(name: str, ttl: float, **fields) -> bool:
+    """Take or renew a named lease shared by all instances through MongoDB"""
+    now = time.time()
+    try:
+        locks_collection.update_one(
+            {"_id": name, "$or": [{"owner": INSTANCE_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": INSTANCE_ID, "expires_at": now + ttl, **fields}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # Another instance holds an unexpired lease
+        return False
+
+def renew_lease(name: str, ttl: float):
+    """Extend a lease we hold. Returns the lease document, or None if it was lost"""
+    return locks_collection.find_one_and_update(
+        {"_id": name, "owner": INSTANCE_ID},
+        {"$set": {"expires_at": time.time() + ttl}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def release_lease(name: str):
+    locks_collection.delete_one({"_id": name, "owner": INSTANCE_ID})
+
+def get_active_lease(name: str):
+    """Return the unexpired lease document held by any instance, or None"""
+    return locks_collection.find_one({"_id": name, "expires_at": {"$gte": time.time()}})
+
+# Background tasks that only the elected leader runs: name -> async func(application)
+leader_tasks = {}
+is_leader = False
+
+def register_leader_task(name: str, func):
+    leader_tasks[name] = func
+
+async def leader_election_loop(application):
+    """Keep the leader lease and start/stop leader-only tasks on transitions"""
+    global is_leader
+    running = {}
+    try:
+        while True:
+            try:
+                leading = acquire_lease(LEADER_LEASE, LEADER_LEASE_TTL)
+            except Exception as e:
+                logger.error(f"Leader election error: {e}")
+                leading = False
+
+            if leading and not is_leader:
+                logger.info(f"Instance {INSTANCE_ID} became leader")
+                for name, func in leader_tasks.items():
+                    running[name] = asyncio.create_task(func(application))
+            elif not leading and is_leader:
+                logger.warning(f"Instance {INSTANCE_ID} lost leadership")
+                for task in running.values():
+                    task.cancel()
+                running.clear()
+            is_leader = leading
+
+            await asyncio.sleep(LEADER_LEASE_TTL / 3)
+    finally:
+        for task in running.values():
+            task.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        if is_leader:
+            release_lease(LEADER_LEASE)
+            is_leader = False
+
+# Local caches that other instances can invalidate: name -> [callbacks]
+cache_invalidators = {}
+cache_seen_versions = {}
+
+def register_cache(name: str, invalidate):
+    cache_invalidators.setdefault(name, []).append(invalidate)
+
+def publish_invalidation(name: str):
+    """Invalidate a cache here now and on every other instance at its next sync"""
+    doc = cache_versions_collection.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    cache_seen_versions[name] = doc["version"]
+    for invalidate in cache_invalidators.get(name, []):
+        invalidate()
+
+def sync_cache_versions(invalidate: bool = True):
+    """Compare cache versions with MongoDB and run invalidators of changed caches"""
+    for doc in cache_versions_collection.find({"_id": {"$in": list(cache_invalidators)}}):
+        name = doc["_id"]
+        if cache_seen_versions.get(name, 0) != doc["version"]:
+            cache_seen_versions[name] = doc["version"]
+            if invalidate:
+                logger.info(f"Cache '{name}' invalidated by another instance")
+                for callback in cache_invalidators[name]:
+                    callback()
+
+async def cache_sync_loop(application):
+    """Poll cache versions so invalidations published elsewhere reach this instance"""
+    while True:
+        await asyncio.sleep(CACHE_SYNC_INTERVAL)
+        try:
+            sync_cache_versions()
+        except Exception as e:
+            logger.error(f"Cache sync error: {e}")
+
+# Numeric IDs of CHANNEL_ID/GROUP_ID, resolved once at startup
+resolved_chat_ids = {}
+
+def resolve_chat_id(chat_id: str):
+    return resolved_chat_ids.get(chat_id, chat_id)
+
+# In-memory lecture registry: command -> document from custom_commands
+lecture_registry = {}
+# Prefix index over command names and description words: prefix -> set of commands
+lecture_index = {}
+
+def index_tokens(text: str):
+    return re.findall(r"\w+", text.lower())
+
+def build_lecture_index(registry: dict) -> dict:
+    index = {}
+    for command, cmd in registry.items():
+        for token in {command, *index_tokens(cmd.get("description", ""))}:
+            for end in range(1, min(len(token), LECTURE_INDEX_MAX_PREFIX) + 1):
+                index.setdefault(token[:end], set()).add(command)
+    return index
+
+def search_lectures(query: str) -> list:
+    """Commands matching every word of the query, name matches first"""
+    tokens = index_tokens(query)
+    if not tokens:
+        return sorted(lecture_registry)
+    matches = set.intersection(*(lecture_index.get(t[:LECTURE_INDEX_MAX_PREFIX], set()) for t in tokens))
+    return sorted(matches, key=lambda command: (not command.startswith(tokens[0]), command))
+
+def load_lecture_registry():
+    global lecture_registry, lecture_index
+    registry = {cmd["command"]: cmd for cmd in custom_commands_collection.find({})}
+    lecture_index = build_lecture_index(registry)
+    lecture_registry = registry
+    logger.info(f"Loaded {len(lecture_registry)} lecture commands")
+
+register_cache("lectures", load_lecture_registry)
+
+# User IDs already stored in the users collection
+known_users = set()
+
+def load_known_users():
+    known_users.clear()
+    for user in users_collection.find({}, {"user_id": 1, "_id": 0}):
+        known_users.add(user["user_id"])
+    logger.info(f"Loaded {len(known_users)} known users")
+
+class MongoPersistence(BasePersistence):
+    """PTB persistence storing user, chat, bot and callback data in one MongoDB collection.
+
+    Documents are keyed "user:<id>", "chat:<id>", "bot", "callback_data" and
+    "conversation:<name>". PTB hands over changed entries every `update_interval`.
+    Only the fields that changed since the last write are sent, as $set/$unset,
+    so replicas sharing the collection don't overwrite each other's fields. All
+    pending documents are written with a single bulk_write.
+    """
+
+    REFRESHED_PRUNE_SIZE = 10000
+
+    def __init__(self, collection, update_interval: float = 60, refresh_interval: float = 5):
+        super().__init__(store_data=PersistenceInput(), update_interval=update_interval)
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        # Copy of the data last synced per document, to find changed fields
+        self._written = {}
+        # Changes waiting for the next bulk write: _id -> change, or None to delete
+        self._dirty = {}
+        self._flush_task = None
+        self._conversations = {}
+        # Last reload per user id, in time.monotonic() seconds
+        self._refreshed = {}
+
+    def _load(self, kind: str) -> dict:
+        data = {}
+        for doc in self.collection.find({"kind": kind}):
+            data[doc["key"]] = doc.get("data", {})
+            # Keep a separate copy: handlers change the returned dicts in place
+            self._written[doc["_id"]] = copy.deepcopy(data[doc["key"]])
+        return data
+
+    def _load_one(self, doc_id: str):
+        doc = self.collection.find_one({"_id": doc_id})
+        if not doc:
+            return None
+        self._written[doc_id] = copy.deepcopy(doc.get("data", {}))
+        return doc.get("data", {})
+
+    @staticmethod
+    def _merge_changes(older, newer):
+        """Combine two pending changes of one document, `newer` wins"""
+        if newer is None:
+            return None
+        if older is None:
+            # The document was deleted first, rebuild it from the new fields only
+            return dict(newer, replace=True)
+        fields = {k: v for k, v in older["set"].items() if k not in newer["unset"]}
+        fields.update(newer["set"])
+        return {
+            "kind": newer["kind"],
+            "key": newer["key"],
+            "set": fields,
+            "unset": (older["unset"] - set(newer["set"])) | newer["unset"],
+            "replace": older["replace"] or newer["replace"]
+        }
+
+    def _mark(self, doc_id: str, kind: str, key, data):
+        if data is None:
+            self._written.pop(doc_id, None)
+            change = None
+        else:
+            written = self._written.get(doc_id)
+            if written == data:
+                return
+            if written is None or not all(isinstance(k, str) and "." not in k and not k.startswith("$") for k in data):
+                # New document, or keys that can't be used in a field path
+                change = {"kind": kind, "key": key, "set": copy.deepcopy(data), "unset": set(), "replace": True}
+            else:
+                change = {
+                    "kind": kind,
+                    "key": key,
+                    "set": {k: copy.deepcopy(v) for k, v in data.items() if k not in written or written[k] != v},
+                    "unset": {k for k in written if k not in data},
+                    "replace": False
+                }
+            self._written[doc_id] = copy.deepcopy(data)
+        self._dirty[doc_id] = self._merge_changes(self._dirty[doc_id], change) if doc_id in self._dirty else change
+        # PTB calls all update methods of one run together, write them as one batch
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    def _refresh(self, doc_id: str, data: dict):
+        """Pull fields written by other replicas, keeping fields changed locally"""
+        if doc_id in self._dirty:
+            # A write for this document is about to go out
+            return
+        doc = self.collection.find_one({"_id": doc_id}, {"data": 1})
+        stored = doc.get("data", {}) if doc else {}
+        written = self._written.get(doc_id) or {}
+        missing = object()
+        synced = {}
+        for key in set(stored) | set(written) | set(data):
+            if data.get(key, missing) != written.get(key, missing):
+                # Changed here since the last sync, PTB will hand it over for writing
+                if key in written:
+                    synced[key] = written[key]
+                continue
+            if key in stored:
+                data[key] = copy.deepcopy(stored[key])
+                synced[key] = copy.deepcopy(stored[key])
+            else:
+                data.pop(key, None)
+        if doc or doc_id in self._written:
+            self._written[doc_id] = synced
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        self._flush_task = None
+        self._write_dirty()
+
+    def _write_dirty(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        operations = []
+        for doc_id, change in dirty.items():
+            if change is None:
+                operations.append(DeleteOne({"_id": doc_id}))
+            elif change["replace"]:
+                operations.append(ReplaceOne(
+                    {"_id": doc_id},
+                    {"kind": change["kind"], "key": change["key"], "data": change["set"]},
+                    upsert=True
+                ))
+            else:
+                update = {"$set": {"kind": change["kind"], "key": change["key"]}}
+                update["$set"].update({f"data.{k}": v for k, v in change["set"].items()})
+                if change["unset"]:
+                    update["$unset"] = {f"data.{k}": "" for k in change["unset"]}
+                operations.append(UpdateOne({"_id": doc_id}, update, upsert=True))
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Persistence flush failed for {len(operations)} documents: {e}")
+            # Retry on the next flush, merged with anything marked meanwhile
+            for doc_id, change in dirty.items():
+                if doc_id in self._dirty:
+                    self._dirty[doc_id] = self._merge_changes(change, self._dirty[doc_id])
+                else:
+                    self._dirty[doc_id] = change
+
+    async def get_user_data(self):
+        return self._load("user")
+
+    async def get_chat_data(self):
+        return self._load("chat")
+
+    async def get_bot_data(self):
+        return self._load_one("bot") or {}
+
+    async def get_callback_data(self):
+        data = self._load_one("callback_data")
+        if data is None:
+            return None
+        return [tuple(item) for item in data["keyboards"]], data["mapping"]
+
+    async def get_conversations(self, name: str):
+        states = self._load_one(f"conversation:{name}") or {}
+        self._conversations[name] = {tuple(json.loads(key)): state for key, state in states.items()}
+        return dict(self._conversations[name])
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._mark(f"user:{user_id}", "user", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        self._mark(f"chat:{chat_id}", "chat", chat_id, data)
+
+    async def update_bot_data(self, data: dict):
+        self._mark("bot", "bot", None, data)
+
+    async def update_callback_data(self, data):
+        keyboards, mapping = data
+        self._mark("callback_data", "callback_data", None, {"keyboards": [list(item) for item in keyboards], "mapping": mapping})
+
+    async def update_conversation(self, name: str, key, new_state):
+        states = self._conversations.setdefault(name, {})
+        if new_state is None:
+            states.pop(key, None)
+        else:
+            states[key] = new_state
+        self._mark(
+            f"conversation:{name}", "conversation", name,
+            {json.dumps(list(k)): state for k, state in states.items()}
+        )
+
+    async def drop_user_data(self, user_id: int):
+        self._mark(f"user:{user_id}", "user", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int):
+        self._mark(f"chat:{chat_id}", "chat", chat_id, None)
+
+    def refresh_user(self, user_id: int, user_data: dict):
+        """Reload a user's data written by other replicas, at most once per refresh interval"""
+        now = time.monotonic()
+        if now - self._refreshed.get(user_id, float("-inf")) < self.refresh_interval:
+            return
+        if len(self._refreshed) >= self.REFRESHED_PRUNE_SIZE:
+            self._refreshed = {k: t for k, t in self._refreshed.items() if now - t < self.refresh_interval}
+        self._refreshed[user_id] = now
+        try:
+            self._refresh(f"user:{user_id}", user_data)
+        except Exception as e:
+            logger.error(f"Failed to refresh data of user {user_id}: {e}")
+
+    # PTB calls these before flood control runs, so they must not touch MongoDB.
+    # flood_control calls refresh_user for admitted updates instead, and chat
+    # and bot data are not read per update.
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        self._write_dirty()
+
+# Buffered counter increments: (stats document id, field) -> amount
+pending_stats = {}
+
+def daily_stats_id(timestamp: float = None) -> str:
+    return "daily:" + time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+def count_stat(field: str, amount: int = 1):
+    """Add to a running total and to today's rollup, written on the next flush"""
+    for doc_id in ("totals", daily_stats_id()):
+        pending_stats[(doc_id, field)] = pending_stats.get((doc_id, field), 0) + amount
+
+def flush_stats():
+    global pending_stats
+    if not pending_stats:
+        return
+    pending, pending_stats = pending_stats, {}
+    increments = {}
+    for (doc_id, field), amount in pending.items():
+        increments.setdefault(doc_id, {})[field] = amount
+    try:
+        stats_collection.bulk_write(
+            [UpdateOne({"_id": doc_id}, {"$inc": inc}, upsert=True) for doc_id, inc in increments.items()],
+            ordered=False
+        )
+    except Exception:
+        # Keep the increments so the next flush retries them
+        for key, amount in pending.items():
+            pending_stats[key] = pending_stats.get(key, 0) + amount
+        raise
+
+def seed_stats():
+    """Initialize running totals from a one-off count if they don't exist yet"""
+    if stats_collection.find_one({"_id": "totals"}, {"_id": 1}):
+        return
+    stats_collection.update_one(
+        {"_id": "totals"},
+        {"$setOnInsert": {
+            "users_total": users_collection.count_documents({}),
+            "users_blocked": users_collection.count_documents({"blocked": True})
+        }},
+        upsert=True
+    )
+    logger.info("Seeded statistics counters from the users collection")
+
+def get_stats_totals() -> dict:
+    """Return flushed totals plus increments still buffered on this instance"""
+    totals = stats_collection.find_one({"_id": "totals"}) or {}
+    for (doc_id, field), amount in pending_stats.items():
+        if doc_id == "totals":
+            totals[field] = totals.get(field, 0) + amount
+    return totals
+
+def set_user_blocked(user_id: int, blocked: bool):
+    """Record whether a user blocked the bot, counting only real state changes"""
+    query = {"user_id": user_id, "blocked": {"$ne": True} if blocked else True}
+    result = users_collection.update_one(query, {"$set": {"blocked": blocked}})
+    if result.modified_count:
+        count_stat("users_blocked", 1 if blocked else -1)
+
+async def stats_flush_loop(application):
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        try:
+            flush_stats()
+        except Exception as e:
+            logger.error(f"Stats flush error: {e}")
+
+# Cached at startup, the server version doesn't change while we run
+mongo_version = "Unknown"
+
 async def is_owner(user_id: int) -> bool:
     return str(user_id) == ADMIN_USER_ID
 
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second"""
+    __slots__ = ("rate", "capacity", "tokens", "updated", "warned")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.warned = False
+
+    def consume(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.warned = False
+            return True
+        return False
+
+    def is_idle(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+# Per-user buckets keyed by (user_id, update class)
+flood_buckets = {}
+FLOOD_BUCKETS_PRUNE_SIZE = 10000
+
+# Activity seen by this instance, used to find idle periods and users worth re-verifying
+last_update_monotonic = 0.0
+recently_active = {}
+
+def classify_update(update: Update):
+    """Return the flood control class of an update, or None if it is not limited"""
+    if update.callback_query:
+        return "callback"
+    message = update.effective_message
+    if message is None:
+        return None
+    if message.text and message.text.startswith('/'):
+        return "command"
+    return "message"
+
+async def flood_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Middleware run before all handlers to drop updates from users over their limit"""
+    global last_update_monotonic
+    last_update_monotonic = time.monotonic()
+
+    user = update.effective_user
+    if not user:
+        return
+    if REQUIRES_VERIFICATION:
+        # Read and pruned by the verification sweeper, which only runs with verification
+        recently_active[user.id] = time.time()
+
+    flood_class = None if await is_owner(user.id) else classify_update(update)
+    if flood_class is not None:
+        key = (user.id, flood_class)
+        bucket = flood_buckets.get(key)
+        if bucket is None:
+            # Drop buckets that have fully refilled before the table grows unbounded
+            if len(flood_buckets) >= FLOOD_BUCKETS_PRUNE_SIZE:
+                for idle_key in [k for k, b in flood_buckets.items() if b.is_idle()]:
+                    del flood_buckets[idle_key]
+            rate, burst = FLOOD_LIMITS[flood_class]
+            bucket = flood_buckets[key] = TokenBucket(rate, burst)
+
+        if not bucket.consume():
+            logger.warning(f"Flood control: dropping {flood_class} update from user {user.id}")
+            try:
+                if update.callback_query:
+                    # Answer instantly and let the client cache it so repeated taps stay local
+                    await update.callback_query.answer(
+                        FLOOD_CALLBACK_RESPONSE,
+                        cache_time=FLOOD_CALLBACK_CACHE_TIME
+                    )
+                elif not bucket.warned:
+                    bucket.warned = True
+                    await update.effective_message.reply_text(FLOOD_MESSAGE_RESPONSE)
+            except Exception as e:
+                logger.error(f"Flood control response failed for user {user.id}: {e}")
+            raise ApplicationHandlerStop
+
+    # Only admitted updates reload user data written by other replicas
+    persistence = context.application.persistence
+    if isinstance(persistence, MongoPersistence):
+        persistence.refresh_user(user.id, context.user_data)
+
 async def generate_invite_link(context: ContextTypes.DEFAULT_TYPE, chat_id: str) -> str:
     """Generate a temporary invite link that expires in 5 minutes"""
     try:
@@ -115,7 +754,7 @@ async def check_membership(user_id: int, context: ContextTypes.DEFAULT_TYPE, cha
             # Try different approaches to check membership
             try:
                 # First try the standard method
-                member = await context.bot.get_chat_member(chat_id=chat_id, user_id=user_id)
+                member = await context.bot.get_chat_member(chat_id=resolve_chat_id(chat_id), user_id=user_id)
                 status = member.status
                 logger.info(f"Membership check for user {user_id} in {chat_id}: {status} (attempt {attempt+1})")
                 
@@ -168,6 +807,82 @@ async def check_all_memberships(user_id: int, context: ContextTypes.DEFAULT_TYPE
     
     return all(results)
 
+async def verify_user(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Membership check that trusts a successful verification for VERIFICATION_TTL"""
+    if not REQUIRES_VERIFICATION:
+        return True
+    
+    if time.time() - context.user_data.get("verified_at", 0) < VERIFICATION_TTL:
+        return True
+    
+    if await check_all_memberships(user_id, context):
+        context.user_data["verified_at"] = time.time()
+        return True
+    
+    context.user_data.pop("verified_at", None)
+    return False
+
+MEMBER_STATUSES = ('member', 'administrator', 'creator', 'restricted')
+
+async def fetch_membership(bot, user_id: int) -> bool:
+    """Single-attempt membership lookup that raises on API errors instead of denying"""
+    for chat_id in (CHANNEL_ID, GROUP_ID):
+        if chat_id:
+            member = await bot.get_chat_member(chat_id=resolve_chat_id(chat_id), user_id=user_id)
+            if member.status not in MEMBER_STATUSES:
+                return False
+    return True
+
+async def sweep_verifications(application):
+    """Re-verify a batch of active users whose verification is getting old"""
+    now = time.time()
+    for user_id, seen in list(recently_active.items()):
+        if now - seen > SWEEP_ACTIVE_WINDOW:
+            del recently_active[user_id]
+    
+    candidates = []
+    for user_id in recently_active:
+        verified_at = application.user_data.get(user_id, {}).get("verified_at")
+        if verified_at and now - verified_at > SWEEP_REVERIFY_AFTER:
+            candidates.append((verified_at, user_id))
+    candidates.sort()
+    
+    refreshed = revoked = 0
+    for _, user_id in candidates[:SWEEP_BATCH_SIZE]:
+        # Low-priority lane: only call the Bot API while no updates are coming in
+        while time.monotonic() - last_update_monotonic < SWEEP_IDLE_SECONDS:
+            await asyncio.sleep(SWEEP_IDLE_SECONDS)
+        
+        try:
+            is_member = await fetch_membership(application.bot, user_id)
+        except Exception as e:
+            # Keep the stored state, the hot path re-checks once it expires
+            logger.warning(f"Re-verification of user {user_id} failed: {e}")
+            continue
+        finally:
+            await asyncio.sleep(1 / SWEEP_RATE)
+        
+        user_data = application.user_data[user_id]
+        if is_member:
+            user_data["verified_at"] = time.time()
+            refreshed += 1
+        else:
+            user_data.pop("verified_at", None)
+            revoked += 1
+            logger.info(f"User {user_id} left a required chat, verification revoked")
+        application.mark_data_for_update_persistence(user_ids=user_id)
+    
+    if refreshed or revoked:
+        logger.info(f"Verification sweep: {refreshed} refreshed, {revoked} revoked")
+
+async def verification_sweeper(application):
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await sweep_verifications(application)
+        except Exception as e:
+            logger.error(f"Verification sweep error: {e}")
+
 # Add restricted decorator to limit bot access :cite[1]:cite[7]
 def restricted(func):
     from functools import wraps
@@ -177,7 +892,7 @@ def restricted(func):
         user_id = update.effective_user.id
         
         # Check if user is member of required groups/channels
-        is_member = await check_all_memberships(user_id, context)
+        is_member = await verify_user(user_id, context)
         if not is_member and REQUIRES_VERIFICATION:
             logger.warning(f"Unauthorized access attempt by user {user_id}")
             await send_verification_request(update, context)
@@ -195,15 +910,40 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"New user: {user_id} ({username})")
         
         # Check if user exists in DB
-        user_data = users_collection.find_one({"user_id": user_id})
-        if not user_data:
-            users_collection.insert_one({
-                "user_id": user_id,
-                "username": username,
-                "first_name": first_name,
-                "date_added": time.time()
-            })
-            logger.info(f"Added new user to DB: {user_id}")
+        if user_id not in known_users:
+            user_data = users_collection.find_one({"user_id": user_id}, {"_id": 1})
+            if not user_data:
+                users_collection.insert_one({
+                    "user_id": user_id,
+                    "username": username,
+                    "first_name": first_name,
+                    "date_added": time.time()
+                })
+                count_stat("users_total")
+                count_stat("new_users")
+                logger.info(f"Added new user to DB: {user_id}")
+            known_users.add(user_id)
+        
+        # Deep link payload (t.me/<bot>?start=<command>) jumps straight to a lecture group
+        lecture_command = context.args[0].lower() if context.args else None
+        if lecture_command not in lecture_registry:
+            lecture_command = None
+        
+        if lecture_command:
+            if await verify_user(user_id, context):
+                text, reply_markup = build_lecture_message(lecture_command, lecture_registry[lecture_command])
+                await update.message.reply_text(
+                    text,
+                    reply_markup=reply_markup,
+                    protect_content=True
+                )
+                logger.info(f"Sent deep-linked lecture /{lecture_command} to user {user_id}")
+            else:
+                # Deliver the lecture once the user taps "I've Joined"
+                context.user_data["pending_lecture"] = lecture_command
+                await send_verification_request(update, context)
+                logger.info(f"User {user_id} needs verification for deep-linked /{lecture_command}")
+            return
         
         # Check if verification is required
         if not REQUIRES_VERIFICATION:
@@ -224,7 +964,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Check membership in all required chats
-        is_member = await check_all_memberships(user_id, context)
+        is_member = await verify_user(user_id, context)
         if is_member:
             welcome_message = (
                 "╭───❖━❀🌟❀━❖───╮\n"
@@ -325,12 +1065,20 @@ async def check_membership_callback(update: Update, context: ContextTypes.DEFAUL
         logger.info(f"Membership check callback from user: {user_id}")
         
         # Check membership in all required chats
-        is_member = await check_all_memberships(user_id, context)
+        is_member = await verify_user(user_id, context)
         if is_member:
-            await query.edit_message_text(
-                "✅ Verification successful!\n"
-                "Use /lecture to see all available groups or /help for assistance."
-            )
+            pending_lecture = context.user_data.pop("pending_lecture", None)
+            if pending_lecture in lecture_registry:
+                text, reply_markup = build_lecture_message(pending_lecture, lecture_registry[pending_lecture])
+                await query.edit_message_text(
+                    "✅ Verification successful!\n\n" + text,
+                    reply_markup=reply_markup
+                )
+            else:
+                await query.edit_message_text(
+                    "✅ Verification successful!\n"
+                    "Use /lecture to see all available groups or /help for assistance."
+                )
             logger.info(f"User {user_id} verified successfully in all required chats")
         else:
             # Find out which chats the user is missing
@@ -378,7 +1126,7 @@ async def lecture(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"Lecture command from user: {user_id}")
         
         # Get all custom commands
-        commands = list(custom_commands_collection.find({}))
+        commands = list(lecture_registry.values())
         
         if not commands:
             await update.message.reply_text(
@@ -403,6 +1151,14 @@ async def lecture(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Lecture command error: {e}")
 
+def normalize_command_name(name: str):
+    """Lowercase a lecture command name without its slash, or None if invalid.
+    Valid names are 1-64 letters a-z, usable both as a bot command and a deep-link payload"""
+    name = name.lower().strip()
+    if name.startswith('/'):
+        name = name[1:]
+    return name if re.fullmatch(r"[a-z]{1,64}", name) else None
+
 # Admin command to add new lecture group command with description
 @restricted  # Add restricted decorator :cite[1]:cite[7]
 async def add_lecture(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -430,11 +1186,9 @@ async def add_lecture(update: Update, context: ContextTypes.DEFAULT_TYPE):
         description = ' '.join(context.args[2:])
         
         # Validate command name
-        if command_name.startswith('/'):
-            command_name = command_name[1:]
-            
-        if not command_name.isalpha():
-            await update.message.reply_text("❌ Command name must contain only letters!")
+        command_name = normalize_command_name(command_name)
+        if not command_name:
+            await update.message.reply_text("❌ Command name must contain only letters a-z (at most 64)!")
             return
             
         # Save to database with description
@@ -446,6 +1200,7 @@ async def add_lecture(update: Update, context: ContextTypes.DEFAULT_TYPE):
             }},
             upsert=True
         )
+        publish_invalidation("lectures")
         
         await update.message.reply_text(
             f"✅ Lecture group command added successfully!\n\n"
@@ -486,6 +1241,7 @@ async def remove_lecture(update: Update, context: ContextTypes.DEFAULT_TYPE):
         result = custom_commands_collection.delete_one({"command": command_name})
         
         if result.deleted_count > 0:
+            publish_invalidation("lectures")
             await update.message.reply_text(f"✅ Command /{command_name} has been removed.")
             logger.info(f"Removed lecture command: /{command_name}")
         else:
@@ -496,6 +1252,245 @@ async def remove_lecture(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Removelecture command error: {e}")
         await update.message.reply_text("⚠️ Failed to remove lecture command. Please try again.")
 
+def build_lecture_message(command: str, cmd_data: dict):
+    """Text and join/tutorial keyboard sent for a lecture command"""
+    # Create inline buttons for group link and tutorial
+    keyboard = [
+        [InlineKeyboardButton(f"👉 Join {command.capitalize()} Group 👈", url=cmd_data["link"])],
+        [InlineKeyboardButton("📺 Watch Tutorial Video", url=TUTORIAL_VIDEO_LINK)]
+    ]
+    
+    # Get description or use default
+    description = cmd_data.get("description", f"Join the {command} group")
+    
+    text = (
+        f"📚 {description}\n\n"
+        "Click the button below to join the group:\n"
+        "Need help joining? Watch the tutorial video!"
+    )
+    return text, InlineKeyboardMarkup(keyboard)
+
+def build_lecture_share_message(command: str, cmd_data: dict, bot_username: str):
+    """Text and keyboard for sharing a lecture in other chats. The button opens the bot
+    through a deep link, so every recipient is verified before getting the group link"""
+    keyboard = [
+        [InlineKeyboardButton(f"👉 Get {command.capitalize()} Group Link 👈", url=create_deep_linked_url(bot_username, command))]
+    ]
+    
+    description = cmd_data.get("description", f"Join the {command} group")
+    
+    text = (
+        f"📚 {description}\n\n"
+        "Tap the button below to get the group link from the bot."
+    )
+    return text, InlineKeyboardMarkup(keyboard)
+
+def iter_lecture_rows(data: bytes, file_name: str):
+    """Yield (row number, fields) from a CSV, JSON or JSON Lines upload.
+    Unreadable JSON Lines rows are yielded as their ValueError"""
+    name = (file_name or "").lower()
+    if name.endswith(".json"):
+        rows = json.loads(data)
+        if not isinstance(rows, list):
+            raise ValueError("JSON file must contain a list of lectures")
+        for number, row in enumerate(rows, start=1):
+            yield number, row
+    elif name.endswith(".jsonl"):
+        for number, line in enumerate(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig"), start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, e
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline=""))
+        # Row numbers match the file's lines, counting the header as line 1
+        for number, row in enumerate(reader, start=2):
+            yield number, row
+
+def parse_lecture_rows(rows):
+    """Validate lecture rows. Returns ({command: (row number, link, description)}, errors)"""
+    lectures = {}
+    errors = []
+    for number, row in rows:
+        if isinstance(row, ValueError):
+            errors.append(f"row {number}: invalid JSON ({row})")
+            continue
+        if not isinstance(row, dict):
+            errors.append(f"row {number}: expected an object with command, link and description")
+            continue
+        command = normalize_command_name(str(row.get("command") or ""))
+        link = str(row.get("link") or "").strip()
+        description = str(row.get("description") or "").strip()
+        if not command:
+            errors.append(f"row {number}: command name must contain only letters a-z (at most 64)")
+        elif not link:
+            errors.append(f"row {number}: missing link for /{command}")
+        elif not description:
+            errors.append(f"row {number}: missing description for /{command}")
+        elif command in lectures:
+            errors.append(f"row {number}: /{command} already defined in row {lectures[command][0]}")
+        else:
+            lectures[command] = (number, link, description)
+    return lectures, errors
+
+# Admin command to import lecture groups from an uploaded CSV/JSON document
+@restricted  # Add restricted decorator :cite[1]:cite[7]
+async def import_lectures(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id = update.effective_user.id
+        logger.info(f"Importlectures command from user: {user_id}")
+        
+        if not await is_owner(user_id):
+            await update.message.reply_text("❌ This command is for bot owner only!")
+            logger.warning(f"Unauthorized importlectures attempt by {user_id}")
+            return
+        
+        reply = update.message.reply_to_message
+        document = update.message.document or (reply.document if reply else None)
+        if not document:
+            await update.message.reply_text(
+                "⚠️ Please send a CSV or JSON file with /importlectures as caption, "
+                "or reply to the file with /importlectures.\n"
+                "Columns: command, link, description\n"
+                "Tip: /exportlectures gives you a file in the right format."
+            )
+            return
+        
+        if document.file_size and document.file_size > LECTURE_IMPORT_MAX_BYTES:
+            await update.message.reply_text("❌ File is too large! Maximum size is 5 MB.")
+            return
+        
+        file = await context.bot.get_file(document.file_id)
+        data = bytes(await file.download_as_bytearray())
+        
+        try:
+            lectures, errors = parse_lecture_rows(iter_lecture_rows(data, document.file_name))
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            await update.message.reply_text(f"❌ Could not read the file: {e}")
+            return
+        
+        # Apply all valid rows in a single round-trip
+        commands = list(lectures)
+        inserted = updated = 0
+        if commands:
+            operations = [
+                UpdateOne(
+                    {"command": command},
+                    {"$set": {"link": lectures[command][1], "description": lectures[command][2]}},
+                    upsert=True
+                )
+                for command in commands
+            ]
+            try:
+                result = custom_commands_collection.bulk_write(operations, ordered=False)
+                details = result.bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+                for write_error in details.get("writeErrors", []):
+                    command = commands[write_error["index"]]
+                    errors.append(f"row {lectures[command][0]}: /{command} not saved ({write_error.get('errmsg', 'write error')})")
+            inserted = details.get("nUpserted", 0)
+            updated = details.get("nMatched", 0)
+            
+            # Refresh the lecture registry once for the whole import
+            publish_invalidation("lectures")
+        
+        report = (
+            "📥 Lecture import finished!\n\n"
+            f"🆕 Added: {inserted}\n"
+            f"♻️ Updated: {updated}\n"
+            f"❌ Rejected: {len(errors)}"
+        )
+        if errors:
+            report += "\n\n" + "\n".join(errors[:LECTURE_IMPORT_MAX_ERRORS_SHOWN])
+            if len(errors) > LECTURE_IMPORT_MAX_ERRORS_SHOWN:
+                report += f"\n... and {len(errors) - LECTURE_IMPORT_MAX_ERRORS_SHOWN} more"
+        
+        await update.message.reply_text(report)
+        logger.info(f"Imported lectures from {document.file_name}: {inserted} added, {updated} updated, {len(errors)} rejected")
+        
+    except Exception as e:
+        logger.error(f"Importlectures command error: {e}")
+        await update.message.reply_text("⚠️ Failed to import lectures. Please try again.")
+
+# Admin command to export all lecture groups as a CSV or JSON document
+@restricted  # Add restricted decorator :cite[1]:cite[7]
+async def export_lectures(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id = update.effective_user.id
+        logger.info(f"Exportlectures command from user: {user_id}")
+        
+        if not await is_owner(user_id):
+            await update.message.reply_text("❌ This command is for bot owner only!")
+            logger.warning(f"Unauthorized exportlectures attempt by {user_id}")
+            return
+        
+        as_json = bool(context.args) and context.args[0].lower() == "json"
+        rows = [
+            {"command": cmd["command"], "link": cmd.get("link", ""), "description": cmd.get("description", "")}
+            for cmd in custom_commands_collection.find({}, {"_id": 0, "command": 1, "link": 1, "description": 1}).sort("command", 1)
+        ]
+        
+        if as_json:
+            data = json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8")
+            file_name = "lectures.json"
+        else:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=["command", "link", "description"])
+            writer.writeheader()
+            writer.writerows(rows)
+            data = buffer.getvalue().encode("utf-8")
+            file_name = "lectures.csv"
+        
+        await update.message.reply_document(
+            document=InputFile(data, filename=file_name),
+            caption=f"📤 {len(rows)} lecture groups exported."
+        )
+        logger.info(f"Exported {len(rows)} lectures as {file_name}")
+        
+    except Exception as e:
+        logger.error(f"Exportlectures command error: {e}")
+        await update.message.reply_text("⚠️ Failed to export lectures. Please try again.")
+
+# Admin command to list deep links that open each lecture group directly
+@restricted  # Add restricted decorator :cite[1]:cite[7]
+async def lecture_links(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id = update.effective_user.id
+        logger.info(f"Lecturelinks command from user: {user_id}")
+        
+        if not await is_owner(user_id):
+            await update.message.reply_text("❌ This command is for bot owner only!")
+            logger.warning(f"Unauthorized lecturelinks attempt by {user_id}")
+            return
+        
+        if not lecture_registry:
+            await update.message.reply_text("📚 No lecture groups available yet.")
+            return
+        
+        lines = []
+        for command in sorted(lecture_registry):
+            # Names stored before validation was tightened may not fit in a deep link
+            if normalize_command_name(command) != command:
+                lines.append(f"⚠️ /{command}: no link, rename it to letters a-z (at most 64)")
+                continue
+            lines.append(f"🔹 /{command}: {create_deep_linked_url(context.bot.username, command)}")
+        
+        # Stay under Telegram's message length limit
+        chunk = "🔗 Lecture Deep Links:\n\n"
+        for line in lines:
+            if len(chunk) + len(line) + 1 > 4000:
+                await update.message.reply_text(chunk, disable_web_page_preview=True)
+                chunk = ""
+            chunk += line + "\n"
+        await update.message.reply_text(chunk, disable_web_page_preview=True)
+        logger.info(f"Sent {len(lines)} lecture deep links to {user_id}")
+        
+    except Exception as e:
+        logger.error(f"Lecturelinks command error: {e}")
+        await update.message.reply_text("⚠️ Failed to generate lecture links. Please try again.")
+
 # Handler for custom lecture commands - UPDATED WITH TUTORIAL VIDEO
 @restricted  # Add restricted decorator :cite[1]:cite[7]
 async def lecture_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -505,25 +1500,14 @@ async def lecture_command_handler(update: Update, context: ContextTypes.DEFAULT_
         
         logger.info(f"Lecture command from user: {user_id} - /{command}")
         
-        # Find command in database
-        cmd_data = custom_commands_collection.find_one({"command": command})
+        # Find command in the lecture registry
+        cmd_data = lecture_registry.get(command)
         if not cmd_data:
             return  # Not a lecture command
         
-        # Create inline buttons for group link and tutorial
-        keyboard = [
-            [InlineKeyboardButton(f"👉 Join {command.capitalize()} Group 👈", url=cmd_data["link"])],
-            [InlineKeyboardButton("📺 Watch Tutorial Video", url=TUTORIAL_VIDEO_LINK)]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Get description or use default
-        description = cmd_data.get("description", f"Join the {command} group")
-        
+        text, reply_markup = build_lecture_message(command, cmd_data)
         await update.message.reply_text(
-            f"📚 {description}\n\n"
-            "Click the button below to join the group:\n"
-            "Need help joining? Watch the tutorial video!",
+            text,
             reply_markup=reply_markup,
             protect_content=True
         )
@@ -547,11 +1531,22 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         test_message = await update.message.reply_text("🏓 Pinging...")
         ping_time = (time.time() - start_time) * 1000  # in milliseconds
         
-        # Get user count
-        user_count = users_collection.count_documents({})
+        # Get running user counters
+        totals = get_stats_totals()
+        user_count = totals.get("users_total", 0)
+        blocked_count = totals.get("users_blocked", 0)
+        
+        # Get new users per day from the daily rollups
+        now = time.time()
+        day_ids = [daily_stats_id(now - day * 86400) for day in range(STATS_TREND_DAYS)]
+        daily = {doc["_id"]: doc for doc in stats_collection.find({"_id": {"$in": day_ids}})}
+        trend_lines = "\n".join(
+            f"  {day_id[6:]}: +{daily.get(day_id, {}).get('new_users', 0)}"
+            for day_id in day_ids
+        )
         
         # Get lecture command count
-        command_count = custom_commands_collection.count_documents({})
+        command_count = len(lecture_registry)
         
         # Get bot uptime
         uptime_seconds = time.time() - bot_start_time
@@ -560,12 +1555,6 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Get versions
         python_version = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
         
-        try:
-            mongo_version = db.command("buildInfo")["version"]
-        except Exception as e:
-            logger.error(f"Failed to get MongoDB version: {e}")
-            mongo_version = "Unknown"
-        
         # Get verification requirements
         verification_status = "No verification required"
         if CHANNEL_ID and GROUP_ID:
@@ -580,9 +1569,12 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "📊 Bot Statistics:\n\n"
             f"🏓 Ping: {ping_time:.2f} ms\n"
             f"👥 Total Users: {user_count}\n"
+            f"✅ Active Users: {user_count - blocked_count}\n"
+            f"🚫 Blocked Users: {blocked_count}\n"
             f"📚 Lecture Groups: {command_count}\n"
             f"⏱️ Uptime: {uptime_str}\n"
             f"🔐 Verification: {verification_status}\n\n"
+            f"📈 New Users (last {STATS_TREND_DAYS} days):\n{trend_lines}\n\n"
             f"🐍 Python: {python_version}\n"
             f"🍃 MongoDB: {mongo_version}"
         )
@@ -593,17 +1585,187 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Stats command error: {e}")
 
-async def run_broadcast(update, context, replied_message, is_forward=False):
-    global broadcast_active, broadcast_cancelled
+# Recently seen albums from the owner: media_group_id -> list of messages
+album_cache = OrderedDict()
+ALBUM_CACHE_SIZE = 50
+
+INPUT_MEDIA_TYPES = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio
+}
+
+async def capture_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remember album items sent to the bot by the owner so they can be broadcast"""
+    message = update.effective_message
+    if not message.media_group_id or not await is_owner(update.effective_user.id):
+        return
+    album_cache.setdefault(message.media_group_id, []).append(message)
+    album_cache.move_to_end(message.media_group_id)
+    while len(album_cache) > ALBUM_CACHE_SIZE:
+        album_cache.popitem(last=False)
+
+def album_item(message: Message):
+    """JSON-friendly description of one album item, or None if it can't be in an album"""
+    if message.photo:
+        media_type, file_id = "photo", message.photo[-1].file_id
+    elif message.video:
+        media_type, file_id = "video", message.video.file_id
+    elif message.document:
+        media_type, file_id = "document", message.document.file_id
+    elif message.audio:
+        media_type, file_id = "audio", message.audio.file_id
+    else:
+        return None
+    return {
+        "type": media_type,
+        "media": file_id,
+        "caption": message.caption,
+        "caption_entities": [entity.to_dict() for entity in message.caption_entities]
+    }
+
+class BroadcastPlan:
+    """A send call resolved once per broadcast job and replayed for every recipient"""
+    __slots__ = ("method", "params", "kwargs")
+
+    def __init__(self, method: str, params: dict):
+        self.method = method
+        # JSON-friendly parameters, kept for checkpoints
+        self.params = params
+        self.kwargs = dict(params, protect_content=True)
+        if method == "send_media_group":
+            self.kwargs["media"] = [
+                INPUT_MEDIA_TYPES[item["type"]](
+                    media=item["media"],
+                    caption=item["caption"],
+                    caption_entities=MessageEntity.de_list(item["caption_entities"], None),
+                    parse_mode=None
+                )
+                for item in params["media"]
+            ]
+
+    async def send(self, bot, chat_id):
+        return await getattr(bot, self.method)(chat_id=chat_id, **self.kwargs)
+
+    def to_dict(self) -> dict:
+        return {"method": self.method, "params": self.params}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["method"], data["params"])
+
+def build_broadcast_plan(replied_message: Message = None, text: str = None, is_forward: bool = False):
+    """Resolve what to send: a text, a forward, a copy of the message, or its whole album.
+    Returns (plan, notice for the admin or None)"""
+    if text is not None:
+        return BroadcastPlan("send_message", {"text": text, "disable_web_page_preview": True}), None
+    
+    source = {"from_chat_id": replied_message.chat_id, "message_id": replied_message.message_id}
+    if is_forward:
+        return BroadcastPlan("forward_message", source), None
     
+    notice = None
+    if replied_message.media_group_id:
+        album = album_cache.get(replied_message.media_group_id, [])
+        items = [album_item(message) for message in sorted(album, key=lambda m: m.message_id)]
+        # Telegram only accepts albums of 2-10 items
+        if len(items) >= 2 and all(items):
+            return BroadcastPlan("send_media_group", {"media": items}), (
+                f"🖼️ Sending the album with {len(items)} items. "
+                "If any are missing, send the album to me again and reply to it."
+            )
+        # Items received before a restart or by another instance are not in the cache
+        logger.warning(f"Album {replied_message.media_group_id} not fully captured ({len(items)} items), sending the replied item only")
+        notice = (
+            "⚠️ This album was not fully received by this bot instance, only the replied item will be sent.\n"
+            "To send the whole album, send it to me again and reply to it."
+        )
+    
+    # copy_message covers every other type, including polls, and keeps captions and entities
+    return BroadcastPlan("copy_message", source), notice
+
+def write_user_snapshot(path: str, active_only: bool = False) -> int:
+    """Stream user IDs in `_id` order into a gzip'd CSV. Returns the number of rows"""
+    query = {"blocked": {"$ne": True}} if active_only else {}
+    cursor = users_collection.find(query, {"_id": 1, "user_id": 1}).sort("_id", 1).batch_size(USER_EXPORT_BATCH_SIZE)
+    count = 0
+    with gzip.open(path, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_id"])
+        for user in cursor:
+            writer.writerow([user["user_id"]])
+            count += 1
+    return count
+
+def iter_user_snapshot(path: str, skip: int = 0):
+    """Yield user IDs from a snapshot written by /exportusers, after the first `skip` rows"""
+    with gzip.open(path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != ["user_id"]:
+            raise ValueError("not a user export, the first row must be 'user_id'")
+        for number, row in enumerate(itertools.islice(reader, skip, None), start=skip + 2):
+            try:
+                yield int(row[0])
+            except (IndexError, ValueError):
+                raise ValueError(f"row {number}: expected a numeric user ID")
+
+def count_user_snapshot(path: str) -> int:
+    """Validate a snapshot file and count its user IDs"""
+    return sum(1 for _ in iter_user_snapshot(path))
+
+async def download_user_snapshot(bot, file_id: str) -> str:
+    """Download a snapshot to a temporary file. The caller removes it"""
+    fd, path = tempfile.mkstemp(suffix=".csv.gz")
+    os.close(fd)
     try:
-        user_id = update.effective_user.id
-        total_users = users_collection.count_documents({})
-        success_count = 0
-        failed_count = 0
-        
-        progress_msg = await update.message.reply_text(
-            f"📢 Starting {'forward' if is_forward else 'broadcast'} to {total_users} users...\n"
+        file = await bot.get_file(file_id)
+        await file.download_to_drive(custom_path=path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def claim_pinned_audience():
+    """Take the audience pinned with /useaudience, if any, for one broadcast"""
+    audience = audiences_collection.find_one_and_delete({"_id": PINNED_AUDIENCE})
+    if audience:
+        audience.pop("_id")
+    return audience
+
+def restore_pinned_audience(audience: dict):
+    """Pin a claimed audience again after its broadcast failed, unless a new one was pinned"""
+    audiences_collection.update_one({"_id": PINNED_AUDIENCE}, {"$setOnInsert": audience}, upsert=True)
+
+async def run_broadcast(bot, admin_chat_id, plan, is_forward=False, job=None):
+    """Send a message to all users in `_id` order, or to the users of the pinned snapshot.
+    `job` is a checkpoint to resume from"""
+    global broadcast_active, broadcast_cancelled, broadcast_paused
+    
+    audience = None
+    claimed_audience = None
+    audience_path = None
+    try:
+        if job:
+            total_users = job["total_users"]
+            success_count = job["success_count"]
+            failed_count = job["failed_count"]
+            last_user_oid = job["last_user_oid"]
+            audience = job.get("audience")
+            audience_offset = job.get("audience_offset", 0)
+        else:
+            audience = claimed_audience = claim_pinned_audience()
+            total_users = audience["count"] if audience else get_stats_totals().get("users_total", 0)
+            success_count = 0
+            failed_count = 0
+            last_user_oid = None
+            audience_offset = 0
+        
+        progress_msg = await bot.send_message(
+            admin_chat_id,
+            f"📢 Starting {'forward' if is_forward else 'broadcast'} to {total_users} users"
+            f"{' of the pinned audience' if audience else ''}...\n"
             f"✅ Success: {success_count}\n"
             f"❌ Failed: {failed_count}\n\n"
             f"⏸️ Use /cancel to stop the {'forward' if is_forward else 'broadcast'}"
@@ -612,17 +1774,40 @@ async def run_broadcast(update, context, replied_message, is_forward=False):
         # Set broadcast as active
         broadcast_active = True
         broadcast_cancelled = False
+        broadcast_paused = False
+        last_lease_renewal = time.monotonic()
+        
+        # Recipients as (user_id, known blocked flag, checkpoint position after sending)
+        if audience:
+            audience_path = await download_user_snapshot(bot, audience["file_id"])
+            recipients = (
+                (user_id, None, position)
+                for position, user_id in enumerate(iter_user_snapshot(audience_path, audience_offset), start=audience_offset + 1)
+            )
+        else:
+            query = {"_id": {"$gt": last_user_oid}} if last_user_oid else {}
+            recipients = (
+                (user["user_id"], user.get("blocked"), user["_id"])
+                for user in users_collection.find(query, {"user_id": 1, "blocked": 1}).sort("_id", 1)
+            )
         
-        # Function to send message to a user
-        async def send_to_user(user_id, send_func, *args, **kwargs):
-            try:
-                await send_func(chat_id=user_id, *args, **kwargs)
-                return True
-            except Exception as e:
-                logger.error(f"Failed to send to user {user_id}: {e}")
-                return False
-        
-        for user in users_collection.find():
+        for user_id, blocked, position in recipients:
+            # Keep the broadcast lease alive and pick up cancels from other instances
+            if time.monotonic() - last_lease_renewal >= BROADCAST_LEASE_TTL / 3:
+                last_lease_renewal = time.monotonic()
+                lease = renew_lease(BROADCAST_LEASE, BROADCAST_LEASE_TTL)
+                if lease is None:
+                    logger.error("Broadcast lease lost, stopping to avoid duplicate sends")
+                    await progress_msg.edit_text(
+                        f"⚠️ {'Forward' if is_forward else 'Broadcast'} stopped: lost the broadcast lock!\n"
+                        f"📢 Sent to: {success_count + failed_count} users\n"
+                        f"✅ Success: {success_count}\n"
+                        f"❌ Failed: {failed_count}"
+                    )
+                    return
+                if lease.get("cancelled"):
+                    broadcast_cancelled = True
+            
             # Check if broadcast was cancelled
             if broadcast_cancelled:
                 await progress_msg.edit_text(
@@ -635,98 +1820,36 @@ async def run_broadcast(update, context, replied_message, is_forward=False):
                 broadcast_cancelled = False
                 return
             
+            # Checkpoint and stop if the instance is shutting down
+            if broadcast_paused:
+                broadcast_jobs_collection.insert_one({
+                    "admin_chat_id": admin_chat_id,
+                    "is_forward": is_forward,
+                    "plan": plan.to_dict(),
+                    "total_users": total_users,
+                    "success_count": success_count,
+                    "failed_count": failed_count,
+                    "last_user_oid": last_user_oid,
+                    "audience": audience,
+                    "audience_offset": audience_offset,
+                    "paused_at": time.time()
+                })
+                await progress_msg.edit_text(
+                    f"⏸️ {'Forward' if is_forward else 'Broadcast'} paused for a restart, it will resume automatically.\n"
+                    f"📢 Sent to: {success_count + failed_count} users\n"
+                    f"✅ Success: {success_count}\n"
+                    f"❌ Failed: {failed_count}"
+                )
+                logger.info(f"Broadcast paused after {success_count + failed_count} users")
+                return
+            
             try:
-                if is_forward:
-                    # Forward the message
-                    await context.bot.forward_message(
-                        chat_id=user['user_id'],
-                        from_chat_id=replied_message.chat_id,
-                        message_id=replied_message.message_id,
-                        protect_content=True
-                    )
-                    success_count += 1
-                else:
-                    if replied_message.text:
-                        success = await send_to_user(
-                            user['user_id'], 
-                            context.bot.send_message,
-                            text=replied_message.text,
-                            entities=replied_message.entities,
-                            parse_mode=None,
-                            protect_content=True,
-                            disable_web_page_preview=True
-                        )
-                    elif replied_message.photo:
-                        success = await send_to_user(
-                            user['user_id'],
-                            context.bot.send_photo,
-                            photo=replied_message.photo[-1].file_id,
-                            caption=replied_message.caption,
-                            caption_entities=replied_message.caption_entities,
-                            parse_mode=None,
-                            protect_content=True
-                        )
-                    elif replied_message.video:
-                        success = await send_to_user(
-                            user['user_id'],
-                            context.bot.send_video,
-                            video=replied_message.video.file_id,
-                            caption=replied_message.caption,
-                            caption_entities=replied_message.caption_entities,
-                            parse_mode=None,
-                            protect_content=True
-                        )
-                    elif replied_message.document:
-                        success = await send_to_user(
-                            user['user_id'],
-                            context.bot.send_document,
-                            document=replied_message.document.file_id,
-                            caption=replied_message.caption,
-                            caption_entities=replied_message.caption_entities,
-                            parse_mode=None,
-                            protect_content=True
-                        )
-                    elif replied_message.audio:
-                        success = await send_to_user(
-                            user['user_id'],
-                            context.bot.send_audio,
-                            audio=replied_message.audio.file_id,
-                            caption=replied_message.caption,
-                            caption_entities=replied_message.caption_entities,
-                            parse_mode=None,
-                            protect_content=True
-                        )
-                    elif replied_message.voice:
-                        success = await send_to_user(
-                            user['user_id'],
-                            context.bot.send_voice,
-                            voice=replied_message.voice.file_id,
-                            caption=replied_message.caption,
-                            caption_entities=replied_message.caption_entities,
-                            parse_mode=None,
-                            protect_content=True
-                        )
-                    elif replied_message.sticker:
-                        success = await send_to_user(
-                            user['user_id'],
-                            context.bot.send_sticker,
-                            sticker=replied_message.sticker.file_id,
-                            protect_content=True
-                        )
-                    else:
-                        # Fallback: forward the message
-                        await context.bot.forward_message(
-                            chat_id=user['user_id'],
-                            from_chat_id=replied_message.chat_id,
-                            message_id=replied_message.message_id,
-                            protect_content=True
-                        )
-                        success = True
-                    
-                    if success:
-                        success_count += 1
-                    else:
-                        failed_count += 1
+                await plan.send(bot, user_id)
+                success_count += 1
+                
+                # A successful send means the user unblocked the bot
+                if blocked:
+                    set_user_blocked(user_id, False)
                 
                 # Update progress every 10 sends
                 if (success_count + failed_count) % 10 == 0:
@@ -738,11 +1861,19 @@ async def run_broadcast(update, context, replied_message, is_forward=False):
                     )
                 
                 # Small delay to avoid rate limiting but allow other tasks to run
-                await asyncio.sleep(0.1)
+                await asyncio.sleep(BROADCAST_DELAY)
                     
+            except Forbidden as e:
+                failed_count += 1
+                logger.error(f"Failed to send to user {user_id}: {e}")
+                set_user_blocked(user_id, True)
             except Exception as e:
                 failed_count += 1
-                logger.error(f"Failed to send to user {user['user_id']}: {e}")
+                logger.error(f"Failed to send to user {user_id}: {e}")
+            if audience:
+                audience_offset = position
+            else:
+                last_user_oid = position
         
         await progress_msg.edit_text(
             f"🎉 {'Forward' if is_forward else 'Broadcast'} completed!\n"
@@ -754,15 +1885,67 @@ async def run_broadcast(update, context, replied_message, is_forward=False):
         
     except Exception as e:
         logger.error(f"{'Fcast' if is_forward else 'Broadcast'} error: {e}")
-        await update.message.reply_text(f"⚠️ An error occurred during {'forward' if is_forward else 'broadcast'}.")
+        error_text = f"⚠️ An error occurred during {'forward' if is_forward else 'broadcast'}."
+        if claimed_audience:
+            try:
+                restore_pinned_audience(claimed_audience)
+                error_text += "\n🎯 The pinned audience is still pinned."
+            except Exception as restore_error:
+                logger.error(f"Failed to restore pinned audience: {restore_error}")
+        await bot.send_message(admin_chat_id, error_text)
     finally:
         # Reset broadcast status
         broadcast_active = False
         broadcast_cancelled = False
+        broadcast_paused = False
+        if audience_path:
+            os.remove(audience_path)
+        try:
+            release_lease(BROADCAST_LEASE)
+        except Exception as e:
+            logger.error(f"Failed to release broadcast lease: {e}")
+
+async def resume_paused_broadcasts(application):
+    """Leader task that resumes broadcasts checkpointed by a stopping instance"""
+    global broadcast_active, broadcast_task
+    while True:
+        await asyncio.sleep(BROADCAST_RESUME_INTERVAL)
+        try:
+            if broadcast_active:
+                continue
+            candidate = broadcast_jobs_collection.find_one({}, sort=[("paused_at", 1)])
+            if not candidate:
+                continue
+            # Rebuild the plan before claiming, a bad job stays stored instead of being lost
+            plan = BroadcastPlan.from_dict(candidate["plan"])
+            if not acquire_lease(BROADCAST_LEASE, BROADCAST_LEASE_TTL, cancelled=False):
+                continue
+            # Claim the job by deleting it so it can never be resumed twice
+            job = broadcast_jobs_collection.find_one_and_delete({"_id": candidate["_id"]})
+            if not job:
+                release_lease(BROADCAST_LEASE)
+                continue
+            broadcast_active = True
+            try:
+                broadcast_task = asyncio.create_task(run_broadcast(
+                    application.bot, job["admin_chat_id"], plan,
+                    is_forward=job["is_forward"], job=job
+                ))
+            except Exception:
+                # Put the checkpoint back and free the lock for the next attempt
+                broadcast_active = False
+                broadcast_jobs_collection.insert_one(job)
+                release_lease(BROADCAST_LEASE)
+                raise
+            logger.info(f"Resumed paused broadcast after {job['success_count'] + job['failed_count']} users")
+        except Exception as e:
+            logger.error(f"Broadcast resume error: {e}")
+
+register_leader_task("broadcast_resumer", resume_paused_broadcasts)
 
 @restricted  # Add restricted decorator :cite[1]:cite[7]
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global broadcast_task
+    global broadcast_active, broadcast_task
     
     try:
         user_id = update.effective_user.id
@@ -773,11 +1956,6 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.warning(f"Unauthorized broadcast attempt by {user_id}")
             return
         
-        # Check if broadcast is already active
-        if broadcast_active:
-            await update.message.reply_text("⚠️ A broadcast is already in progress. Please wait for it to finish or use /cancel to stop it.")
-            return
-        
         # Check if message is a reply
         replied_message = update.message.reply_to_message
         
@@ -788,18 +1966,22 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        if not replied_message:
-            # Create a message from text arguments
-            message_text = ' '.join(context.args)
-            replied_message = type('MockMessage', (), {
-                'text': message_text,
-                'entities': None,
-                'chat_id': update.message.chat_id,
-                'message_id': update.message.message_id
-            })()
-        
-        # Run broadcast in background task
-        broadcast_task = asyncio.create_task(run_broadcast(update, context, replied_message, is_forward=False))
+        # Resolve the payload once for the whole job
+        if replied_message:
+            plan, notice = build_broadcast_plan(replied_message)
+        else:
+            plan, notice = build_broadcast_plan(text=' '.join(context.args))
+        
+        # Take the broadcast lock shared by all instances
+        if broadcast_active or not acquire_lease(BROADCAST_LEASE, BROADCAST_LEASE_TTL, cancelled=False):
+            await update.message.reply_text("⚠️ A broadcast is already in progress. Please wait for it to finish or use /cancel to stop it.")
+            return
+        broadcast_active = True
+        
+        # Run broadcast in background task, it resets the flag and releases the lease when done
+        broadcast_task = asyncio.create_task(run_broadcast(context.bot, update.message.chat_id, plan, is_forward=False))
+        if notice:
+            await update.message.reply_text(notice)
         
     except Exception as e:
         logger.error(f"Broadcast command error: {e}")
@@ -808,7 +1990,7 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # New command to forward messages to all users
 @restricted  # Add restricted decorator :cite[1]:cite[7]
 async def fcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global broadcast_task
+    global broadcast_active, broadcast_task
     
     try:
         user_id = update.effective_user.id
@@ -819,11 +2001,6 @@ async def fcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.warning(f"Unauthorized fcast attempt by {user_id}")
             return
         
-        # Check if broadcast is already active
-        if broadcast_active:
-            await update.message.reply_text("⚠️ A broadcast is already in progress. Please wait for it to finish or use /cancel to stop it.")
-            return
-        
         # Check if message is a reply
         replied_message = update.message.reply_to_message
         
@@ -834,8 +2011,16 @@ async def fcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Run forward in background task
-        broadcast_task = asyncio.create_task(run_broadcast(update, context, replied_message, is_forward=True))
+        plan, _ = build_broadcast_plan(replied_message, is_forward=True)
+        
+        # Take the broadcast lock shared by all instances
+        if broadcast_active or not acquire_lease(BROADCAST_LEASE, BROADCAST_LEASE_TTL, cancelled=False):
+            await update.message.reply_text("⚠️ A broadcast is already in progress. Please wait for it to finish or use /cancel to stop it.")
+            return
+        broadcast_active = True
+        
+        # Run forward in background task, it resets the flag and releases the lease when done
+        broadcast_task = asyncio.create_task(run_broadcast(context.bot, update.message.chat_id, plan, is_forward=True))
         
     except Exception as e:
         logger.error(f"Fcast command error: {e}")
@@ -856,7 +2041,17 @@ async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         if not broadcast_active:
-            await update.message.reply_text("❌ No active broadcast to cancel!")
+            # The broadcast may be running on another instance
+            lease = get_active_lease(BROADCAST_LEASE)
+            if not lease:
+                await update.message.reply_text("❌ No active broadcast to cancel!")
+                return
+            locks_collection.update_one(
+                {"_id": BROADCAST_LEASE, "owner": lease["owner"]},
+                {"$set": {"cancelled": True}}
+            )
+            await update.message.reply_text("⏹️ Cancel requested. The broadcast will stop shortly.")
+            logger.info(f"Broadcast on {lease['owner']} cancelled by {user_id}")
             return
         
         # Set cancellation flag
@@ -876,6 +2071,147 @@ async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Cancel command error: {e}")
         await update.message.reply_text("⚠️ An error occurred while trying to cancel.")
 
+# Admin command to download all user IDs as a gzip'd CSV snapshot
+@restricted  # Add restricted decorator :cite[1]:cite[7]
+async def export_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id = update.effective_user.id
+        logger.info(f"Exportusers command from user: {user_id}")
+        
+        if not await is_owner(user_id):
+            await update.message.reply_text("❌ This command is for bot owner only!")
+            logger.warning(f"Unauthorized exportusers attempt by {user_id}")
+            return
+        
+        active_only = bool(context.args) and context.args[0].lower() == "active"
+        fd, path = tempfile.mkstemp(suffix=".csv.gz")
+        os.close(fd)
+        try:
+            # Cursor reads and compression run in a worker thread, off the event loop
+            count = await asyncio.to_thread(write_user_snapshot, path, active_only)
+            with open(path, "rb") as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=f"users-{time.strftime('%Y%m%d-%H%M%S')}.csv.gz",
+                    caption=(
+                        f"📤 {count} {'active ' if active_only else ''}users exported.\n"
+                        "Reply to this file with /useaudience to send the next broadcast to exactly these users."
+                    )
+                )
+        finally:
+            os.remove(path)
+        logger.info(f"Exported {count} users")
+        
+    except Exception as e:
+        logger.error(f"Exportusers command error: {e}")
+        await update.message.reply_text("⚠️ Failed to export users. Please try again.")
+
+# Admin command to pin a user snapshot as the audience of the next broadcast
+@restricted  # Add restricted decorator :cite[1]:cite[7]
+async def use_audience(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id = update.effective_user.id
+        logger.info(f"Useaudience command from user: {user_id}")
+        
+        if not await is_owner(user_id):
+            await update.message.reply_text("❌ This command is for bot owner only!")
+            logger.warning(f"Unauthorized useaudience attempt by {user_id}")
+            return
+        
+        if context.args and context.args[0].lower() == "clear":
+            audiences_collection.delete_one({"_id": PINNED_AUDIENCE})
+            await update.message.reply_text("🧹 Pinned audience cleared. Broadcasts go to all users again.")
+            return
+        
+        reply = update.message.reply_to_message
+        document = update.message.document or (reply.document if reply else None)
+        if not document:
+            pinned = audiences_collection.find_one({"_id": PINNED_AUDIENCE})
+            status = f"🎯 Currently pinned: {pinned['file_name']} ({pinned['count']} users)" if pinned else "🎯 No audience pinned."
+            await update.message.reply_text(
+                "⚠️ Please reply to a file from /exportusers with /useaudience.\n"
+                "The next /broadcast or /fcast then goes only to the users in that file.\n"
+                "Use /useaudience clear to remove it.\n\n" + status
+            )
+            return
+        
+        path = await download_user_snapshot(context.bot, document.file_id)
+        try:
+            count = await asyncio.to_thread(count_user_snapshot, path)
+        except (ValueError, OSError, EOFError, csv.Error) as e:
+            await update.message.reply_text(f"❌ Could not read the file: {e}")
+            return
+        finally:
+            os.remove(path)
+        
+        if not count:
+            await update.message.reply_text("❌ The file contains no user IDs.")
+            return
+        
+        audiences_collection.replace_one(
+            {"_id": PINNED_AUDIENCE},
+            {"file_id": document.file_id, "file_name": document.file_name, "count": count, "pinned_at": time.time()},
+            upsert=True
+        )
+        await update.message.reply_text(
+            f"🎯 Audience pinned: {count} users.\n"
+            "The next /broadcast or /fcast goes only to them. Use /useaudience clear to undo."
+        )
+        logger.info(f"Pinned broadcast audience {document.file_name} with {count} users")
+        
+    except Exception as e:
+        logger.error(f"Useaudience command error: {e}")
+        await update.message.reply_text("⚠️ Failed to pin the audience. Please try again.")
+
+# Inline mode: "@bot maths" searches the lecture catalog from any chat
+async def inline_lecture_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        inline_query = update.inline_query
+        user_id = inline_query.from_user.id
+        
+        # Membership is re-checked at most once per VERIFICATION_TTL, not per keystroke
+        if not await verify_user(user_id, context):
+            await inline_query.answer(
+                [],
+                cache_time=0,
+                is_personal=True,
+                button=InlineQueryResultsButton(text="🔒 Join our community to search lectures", start_parameter="verify")
+            )
+            return
+        
+        offset = int(inline_query.offset or 0)
+        matches = search_lectures(inline_query.query)
+        page = matches[offset:offset + INLINE_RESULTS_LIMIT]
+        
+        results = []
+        for command in page:
+            cmd_data = lecture_registry[command]
+            # Inline messages can't be protected, so they never carry the invite link itself
+            try:
+                text, reply_markup = build_lecture_share_message(command, cmd_data, context.bot.username)
+            except ValueError as e:
+                # Names stored before validation was tightened may not fit in a deep link
+                logger.warning(f"Skipping lecture /{command} in inline results: {e}")
+                continue
+            results.append(InlineQueryResultArticle(
+                id=command,
+                title=f"/{command}",
+                description=cmd_data.get("description", f"Join the {command} group"),
+                input_message_content=InputTextMessageContent(text),
+                reply_markup=reply_markup
+            ))
+        
+        next_offset = str(offset + INLINE_RESULTS_LIMIT) if offset + INLINE_RESULTS_LIMIT < len(matches) else ""
+        await inline_query.answer(
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=REQUIRES_VERIFICATION,
+            next_offset=next_offset
+        )
+        logger.info(f"Inline search from user {user_id}: '{inline_query.query}' -> {len(matches)} results")
+    except Exception as e:
+        logger.error(f"Inline search error: {e}")
+
 @restricted  # Add restricted decorator :cite[1]:cite[7]
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
@@ -885,7 +2221,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         commands = [
             "/start - Begin using the bot",
             "/lecture - Show all lecture groups",
-            "/help - Show this help message"
+            "/help - Show this help message",
+            f"@{context.bot.username} <subject> - Search lecture groups from any chat"
         ]
         
         # Create inline button for tutorial video
@@ -900,9 +2237,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "\n\n👑 Admin Commands:",
                 "/addlecture <name> <link> <description> - Add new lecture group",
                 "/removelecture <name> - Remove a lecture group",
+                "/importlectures - Add or update lecture groups from a CSV/JSON file",
+                "/exportlectures [json] - Download all lecture groups as CSV or JSON",
+                "/lecturelinks - Get t.me links that open each lecture group directly",
                 "/stats - View bot statistics",
                 "/broadcast <message> - Send message to all users (or reply to a message)",
                 "/fcast - Forward a message to all users (reply to a message)",
+                "/exportusers [active] - Download all user IDs as a gzip'd CSV",
+                "/useaudience [clear] - Send the next broadcast only to the users of an /exportusers file (reply to it)",
                 "/cancel - Cancel ongoing broadcast/forward"
             ]
             commands.extend(admin_commands)
@@ -918,6 +2260,170 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Help command error: {e}")
 
+# Background tasks started on application start: coordination loops per instance
+background_tasks = []
+leader_election_task = None
+
+async def warm_up(application):
+    """Open connections and load caches before the bot accepts any update"""
+    global mongo_version
+    phase_start = time.perf_counter()
+
+    def log_phase(name):
+        nonlocal phase_start
+        now = time.perf_counter()
+        logger.info(f"Startup phase '{name}' took {(now - phase_start) * 1000:.1f} ms")
+        phase_start = now
+
+    # Open the MongoDB pool and make sure indexes exist
+    client.admin.command("ping")
+    custom_commands_collection.create_index("command", unique=True)
+    users_collection.create_index("user_id")
+    try:
+        mongo_version = db.command("buildInfo")["version"]
+    except Exception as e:
+        logger.error(f"Failed to get MongoDB version: {e}")
+    log_phase("mongodb")
+
+    # Resolve @usernames once so membership checks skip the get_chat fallback
+    for chat_id in (CHANNEL_ID, GROUP_ID):
+        if not chat_id:
+            continue
+        try:
+            chat = await application.bot.get_chat(chat_id)
+            resolved_chat_ids[chat_id] = chat.id
+            logger.info(f"Resolved {chat_id} to {chat.id}")
+        except Exception as e:
+            logger.error(f"Failed to resolve {chat_id}: {e}")
+    log_phase("chat resolution")
+
+    sync_cache_versions(invalidate=False)
+    load_lecture_registry()
+    log_phase("lecture registry")
+
+    load_known_users()
+    log_phase("known users")
+
+    seed_stats()
+    log_phase("statistics")
+
+async def post_init(application):
+    """Warm up, start coordination loops and mark the bot as ready"""
+    global leader_election_task
+    await warm_up(application)
+    leader_election_task = asyncio.create_task(leader_election_loop(application))
+    background_tasks.append(leader_election_task)
+    background_tasks.append(asyncio.create_task(cache_sync_loop(application)))
+    background_tasks.append(asyncio.create_task(stats_flush_loop(application)))
+    if REQUIRES_VERIFICATION:
+        # Runs on every instance: each one holds the user_data of the users it serves
+        background_tasks.append(asyncio.create_task(verification_sweeper(application)))
+    logger.info(f"Instance {INSTANCE_ID} started coordination tasks")
+
+    bot_ready.set()
+    logger.info(f"Bot ready {time.time() - bot_start_time:.2f} s after process start")
+
+# Synchronous flush callbacks of buffered writers, run once on shutdown
+flush_hooks = []
+
+def register_flush_hook(func):
+    flush_hooks.append(func)
+
+register_flush_hook(flush_stats)
+
+async def post_stop(application):
+    """Pause running broadcasts and flush buffered writes once updates have drained"""
+    global broadcast_paused
+    shutdown_start = time.monotonic()
+
+    # Give up leadership first, so this instance can't resume the checkpoint it is about to write
+    if leader_election_task:
+        leader_election_task.cancel()
+        await asyncio.gather(leader_election_task, return_exceptions=True)
+
+    if broadcast_active and broadcast_task:
+        broadcast_paused = True
+        try:
+            await asyncio.wait_for(asyncio.shield(broadcast_task), timeout=SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("Broadcast did not checkpoint before the shutdown deadline")
+        except Exception as e:
+            logger.error(f"Broadcast task failed during shutdown: {e}")
+
+    for flush in flush_hooks:
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Flush on shutdown failed: {e}")
+
+    logger.info(f"Graceful shutdown finished in {time.monotonic() - shutdown_start:.2f} s")
+
+async def post_shutdown(application):
+    """Stop coordination loops and give up any leases held by this instance"""
+    bot_ready.clear()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    logger.info(f"Instance {INSTANCE_ID} stopped coordination tasks")
+
+def build_application():
+    """Create the application with all handlers registered"""
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .persistence(MongoPersistence(
+            persistence_collection,
+            update_interval=PERSISTENCE_FLUSH_INTERVAL,
+            refresh_interval=PERSISTENCE_REFRESH_INTERVAL
+        ))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    application = builder.build()
+    
+    # Flood control runs before every other handler group
+    application.add_handler(TypeHandler(Update, flood_control), group=-1)
+
+    # Add handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("lecture", lecture))
+    application.add_handler(CommandHandler("addlecture", add_lecture))
+    application.add_handler(CommandHandler("removelecture", remove_lecture))
+    application.add_handler(CommandHandler("importlectures", import_lectures))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r"^/importlectures(@\w+)?\b"),
+        import_lectures
+    ))
+    application.add_handler(CommandHandler("exportlectures", export_lectures))
+    application.add_handler(CommandHandler("lecturelinks", lecture_links))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(CommandHandler("fcast", fcast))
+    application.add_handler(CommandHandler("cancel", cancel_broadcast))
+    application.add_handler(CommandHandler("exportusers", export_users))
+    application.add_handler(CommandHandler("useaudience", use_audience))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r"^/useaudience(@\w+)?\b"),
+        use_audience
+    ))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CallbackQueryHandler(check_membership_callback))
+    application.add_handler(InlineQueryHandler(inline_lecture_search))
+    
+    # Add handler for custom lecture commands
+    application.add_handler(MessageHandler(filters.COMMAND, lecture_command_handler))
+    
+    # Capture the owner's albums in a separate group so other handlers still run
+    application.add_handler(MessageHandler(
+        filters.ChatType.PRIVATE & (filters.PHOTO | filters.VIDEO | filters.Document.ALL | filters.AUDIO),
+        capture_album
+    ), group=1)
+    return application
+
 def main():
     try:
         # Start Flask health check in a separate thread
@@ -941,25 +2447,21 @@ def main():
 
         # Start Telegram bot
         logger.info("Starting bot application...")
-        application = ApplicationBuilder().token(TOKEN).build()
-        
-        # Add handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("lecture", lecture))
-        application.add_handler(CommandHandler("addlecture", add_lecture))
-        application.add_handler(CommandHandler("removelecture", remove_lecture))
-        application.add_handler(CommandHandler("stats", stats))
-        application.add_handler(CommandHandler("broadcast", broadcast))
-        application.add_handler(CommandHandler("fcast", fcast))
-        application.add_handler(CommandHandler("cancel", cancel_broadcast))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CallbackQueryHandler(check_membership_callback))
-        
-        # Add handler for custom lecture commands
-        application.add_handler(MessageHandler(filters.COMMAND, lecture_command_handler))
-        
-        logger.info("Bot is now polling...")
-        application.run_polling()
+        application = build_application()
+        
+        if WEBHOOK_URL:
+            # Webhook mode lets several replicas share the update stream
+            logger.info(f"Bot is now listening for webhooks on port {WEBHOOK_PORT}...")
+            application.run_webhook(
+                listen="0.0.0.0",
+                port=WEBHOOK_PORT,
+                url_path="telegram",
+                webhook_url=f"{WEBHOOK_URL}/telegram",
+                secret_token=WEBHOOK_SECRET
+            )
+        else:
+            logger.info("Bot is now polling...")
+            application.run_polling()
     except Exception as e:
         logger.critical(f"Fatal error in main: {e}")
         exit(1)